@@ -0,0 +1,113 @@
+"""
+Startup Time Benchmark
+
+This script measures how long a cold start takes before the app can paint,
+by timing in a fresh interpreter:
+    - The import of the app's helper modules (tts, search, llm, huggingface,
+      supabase_client, turns), and which SDKs that import pulls in. This does
+      not load `streamlit_app.py` or streamlit itself
+    - The first full run of `streamlit_app.py` using Streamlit's AppTest
+      harness, when streamlit is installed. The harness is imported before
+      the timer starts, so only the script run is measured
+
+Each measurement is repeated and the median is reported.
+
+Usage:
+    python benchmark_startup.py [--runs N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# SDKs that should only be loaded once a provider is actually used
+HEAVY_MODULES = ["openai", "supabase", "elevenlabs", "pydub", "requests"]
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import tts, search, llm, huggingface, supabase_client, turns
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+FIRST_RUN_PROBE = """
+import json, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file("streamlit_app.py", default_timeout=60)
+app.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "exception": bool(app.exception)}))
+"""
+
+def run_probe(code):
+    """
+    Run a probe script in a fresh interpreter and parse its JSON output.
+
+    Args:
+        code (str): Python source that prints a single JSON object
+
+    Returns:
+        dict or None: The parsed output, or None if the probe failed
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "Probe failed")
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def benchmark(name, code, runs):
+    """
+    Run a probe several times and print the median time.
+
+    Args:
+        name (str): Label printed with the result
+        code (str): The probe to run
+        runs (int): Number of fresh interpreters to start
+
+    Returns:
+        dict or None: The output of the last run, or None if a run failed
+    """
+    timings = []
+    output = None
+    for _ in range(runs):
+        output = run_probe(code)
+        if output is None:
+            print(f"{name}: skipped")
+            return None
+        timings.append(output["seconds"])
+
+    print(f"{name}: median {statistics.median(timings) * 1000:.1f} ms "
+          f"(min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms, {runs} runs)")
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app cold start time")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per measurement")
+    args = parser.parse_args()
+
+    output = benchmark("Helper module import", IMPORT_PROBE % HEAVY_MODULES, args.runs)
+    if output is not None:
+        loaded = ", ".join(output["loaded"]) or "none"
+        print(f"SDKs loaded by helper modules: {loaded}")
+
+    output = benchmark("First script run", FIRST_RUN_PROBE, args.runs)
+    if output is not None and output["exception"]:
+        print("Warning: the first script run raised an exception")
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,51 @@ Models used:
     - facebook/musicgen-small: For music generation
     - black-forest-labs/FLUX.1-schnell: For fast image generation
 
+Generated media is cached in the shared state by model and prompt, so a prompt
+is only generated once across all replicas.
+
 Required Environment Variables:
     - HF_API_KEY: API key for accessing Hugging Face's inference API
 """
 
-import requests
+import providers
+import shared_state
 import os
 
 HF_API_KEY = os.getenv("HF_API_KEY")
 
 headers = {"Authorization": f"Bearer {HF_API_KEY}"}
 
+# Seconds generated media stays in the shared cache
+MEDIA_CACHE_TTL = 7 * 24 * 60 * 60
+
+def query_model(api_url, payload):
+    """
+    Send a request to a model, reusing a cached result for the same request.
+
+    Args:
+        api_url (str): The model's inference API URL
+        payload (dict): The request body
+
+    Returns:
+        bytes: The response content
+
+    Note:
+        Only successful responses are cached, so errors such as a model that
+        is still loading are retried on the next request.
+    """
+    def post():
+        response = providers.get("http").post(api_url, headers=headers, json=payload)
+        return response.ok, response.content
+
+    _, content = shared_state.get_or_create(
+        shared_state.make_key("media", api_url, payload),
+        post,
+        ttl=MEDIA_CACHE_TTL,
+        cacheable=lambda result: result[0]
+    )
+    return content
+
 def generate_music(prompt):
     """
     Generate music based on a text prompt using facebook/musicgen-small model.
@@ -39,9 +73,7 @@ def generate_music(prompt):
         "inputs": prompt,
     }
     
-    response = requests.post(api_url, headers=headers, json=payload)
-
-    return response.content
+    return query_model(api_url, payload)
 
 def generate_image(prompt):
     """
@@ -64,6 +96,4 @@ def generate_image(prompt):
         "num_inference_steps": 4
     }
 
-    response = requests.post(api_url, headers=headers, json=payload)
-
-    return response.content
+    return query_model(api_url, payload)
@@ -4,17 +4,16 @@ A module for interacting with OpenAI's GPT models.
 This module provides functionality to interact with OpenAI's GPT models,
 particularly GPT-4o, for chat completions with specialized tools.
 
+The OpenAI client is created on the first request through the `providers`
+registry, so importing this module does not import the `openai` package.
+
 Required Environment Variables:
     - OPENAI_API_KEY: API key for accessing OpenAI API
 """
 
-from openai import OpenAI
-import os
+import providers
 from supabase_client import track_token_usage
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # System prompts
 ASSISTANT_SYSTEM_PROMPT = """You are a helpful assistant that is able to respond to user questions,
 generate images, generate music, and write research papers.
@@ -145,6 +144,7 @@ def get_chat_completion(messages, stream=True):
         The function includes specialized tools for generating images, music,
         and research papers through function calling.
     """
+    client = providers.get("openai")
     return client.chat.completions.create(
         model="gpt-4o",
         messages=[{"role": "system", "content": ASSISTANT_SYSTEM_PROMPT}] + messages,
@@ -171,6 +171,7 @@ def get_research_completion(query, search_results, stream=True):
         citations, and formatting in markdown.
     """
     system_message = RESEARCH_SYSTEM_PROMPT.format(search_results=search_results)
+    client = providers.get("openai")
     return client.chat.completions.create(
         model="gpt-4o",
         messages=[
@@ -0,0 +1,157 @@
+"""
+Lazy Provider Registry Module
+
+This module keeps track of the third party clients used by the app (OpenAI,
+Supabase, ElevenLabs, an HTTP client and the shared state backend). Each
+provider is registered as a factory, and neither the SDK import nor the client
+construction happens until the first call to `get()`. This keeps the import of
+`streamlit_app.py` cheap, so cold starts and Streamlit reruns do not pay for
+SDKs that the current run never touches.
+
+Clients are created once per process and shared between Streamlit sessions.
+
+Required Environment Variables (read on first use of each provider):
+    - OPENAI_API_KEY: API key for the "openai" provider
+    - SUPABASE_URL, SUPABASE_KEY: Project credentials for the "supabase" provider
+    - ELEVENLABS_API_KEY: API key for the "elevenlabs" provider
+    - SHARED_STATE_URL (optional): Backend URL for the "shared_state" provider
+"""
+
+import os
+import threading
+
+# Default seconds to wait for an HTTP response before giving up
+HTTP_TIMEOUT = 120
+
+# Seconds to wait for an OpenAI response, or between chunks of a stream
+OPENAI_TIMEOUT = 120
+
+_factories = {}
+_instances = {}
+_lock = threading.Lock()
+
+
+def register(name, factory):
+    """
+    Register a factory for a provider, replacing any existing registration.
+
+    Args:
+        name (str): The name the provider is looked up by
+        factory (callable): A function taking no arguments that imports the
+            SDK and returns a ready to use client
+
+    Note:
+        Re-registering a provider drops its cached instance, so the next call
+        to `get()` builds a new client with the new factory.
+    """
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def get(name):
+    """
+    Get the client for a provider, creating it on first use.
+
+    Args:
+        name (str): The name of a registered provider
+
+    Returns:
+        object: The client built by the provider's factory
+
+    Raises:
+        KeyError: If no provider was registered under the given name
+    """
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        # Another thread may have built the client while we waited for the lock
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"Unknown provider: {name}")
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def _create_openai():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=OPENAI_TIMEOUT)
+
+
+def _create_supabase():
+    from supabase import create_client
+    return create_client(
+        os.getenv("SUPABASE_URL"),
+        os.getenv("SUPABASE_KEY")
+    )
+
+
+def _create_elevenlabs():
+    import elevenlabs
+    return elevenlabs.ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"), timeout=HTTP_TIMEOUT)
+
+
+class HttpClient:
+    """
+    An HTTP client that gives each thread its own `requests.Session`.
+
+    requests does not promise that a Session is thread-safe, and the client is
+    shared by every Streamlit session and background turn thread. Each thread
+    keeps its own connection pool instead, and requests get a default timeout.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        """
+        Args:
+            timeout (float, optional): Seconds to wait for a response when the
+                caller does not pass a timeout. Defaults to HTTP_TIMEOUT
+        """
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request with this thread's session.
+
+        Args:
+            method (str): The HTTP method
+            url (str): The URL to request
+            **kwargs: Passed on to `requests.Session.request`
+
+        Returns:
+            requests.Response: The response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self._session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+def _create_http():
+    return HttpClient()
+
+
+def _create_shared_state():
+    from shared_state import create_backend
+    return create_backend()
+
+
+register("openai", _create_openai)
+register("supabase", _create_supabase)
+register("elevenlabs", _create_elevenlabs)
+register("http", _create_http)
+register("shared_state", _create_shared_state)
@@ -4,13 +4,19 @@ A module for performing web searches using the Brave Search API.
 This module provides functionality to search the web using Brave's search engine,
 which offers privacy-focused web search capabilities.
 
+Results are cached in the shared state, so replicas reuse each other's searches.
+
 Required Environment Variables:
     - BRAVE_API_KEY: API key for accessing Brave Search API
 """
 
-import requests
+import providers
+import shared_state
 import os
 
+# Seconds search results stay in the shared cache
+SEARCH_CACHE_TTL = 60 * 60
+
 def search_brave(query):
     """
     Perform a web search using the Brave Search API.
@@ -33,9 +39,18 @@ def search_brave(query):
         'X-Subscription-Token': os.getenv("BRAVE_API_KEY")
     }
     
-    response = requests.get(url, headers=headers)
-    print(f"Debug: Response status code: {response.status_code}")
-    print(f"Debug: Response text: {response.text}")
-    
-    return response.text
+    def fetch():
+        response = providers.get("http").get(url, headers=headers)
+        print(f"Debug: Response status code: {response.status_code}")
+        print(f"Debug: Response text: {response.text}")
+        return response.ok, response.text
+
+    # Only successful responses are cached
+    _, text = shared_state.get_or_create(
+        shared_state.make_key("search", query),
+        fetch,
+        ttl=SEARCH_CACHE_TTL,
+        cacheable=lambda result: result[0]
+    )
+    return text
 
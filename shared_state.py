@@ -0,0 +1,511 @@
+"""
+Shared State Module
+
+This module provides a key-value store that is shared between replicas of the
+app, used to cache generated media, search results and usage totals. Its main
+entry point is `get_or_create()`, which uses a lock in the store so that when
+several replicas miss the same key at once, only one of them runs the
+generation and the others wait for its result.
+
+Backends:
+    - SQLiteBackend: A SQLite file, shared by replicas on a single host only
+    - RedisBackend: Any server speaking the Redis protocol. Requires the
+      optional `redis` package
+
+The backend is chosen by the SHARED_STATE_URL environment variable and created
+on first use through the `providers` registry.
+
+Optional Environment Variables:
+    - SHARED_STATE_URL: "sqlite:///path/to/file.db" or "redis://host:port/db".
+      Defaults to a SQLite file in the system temp directory
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+import providers
+
+# Seconds a single-flight lock is held before other replicas may take it over
+LOCK_TIMEOUT = 300
+
+# Seconds between checks while waiting for another replica's result
+POLL_INTERVAL = 0.5
+
+# Seconds an uncacheable result is kept, so waiters share it instead of retrying
+FAILURE_TTL = 10
+
+def _encode_bytes(value):
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Cannot store {type(value).__name__} in shared state")
+
+def _decode_bytes(value):
+    if value.keys() == {"__bytes__"}:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+def _restore_tuples(value):
+    if isinstance(value, list):
+        return tuple(_restore_tuples(item) for item in value)
+    return value
+
+def encode_value(value):
+    """
+    Serialize a value for the shared state.
+
+    Values are stored as JSON rather than pickled, so that whoever can write to
+    the store cannot run code on the replicas reading it.
+
+    Args:
+        value (object): None, bool, int, float, str, bytes, or tuples and
+            dicts of those
+
+    Returns:
+        bytes: The encoded value
+
+    Raises:
+        TypeError: If the value contains an unsupported type
+    """
+    return json.dumps(value, default=_encode_bytes).encode("utf-8")
+
+def decode_value(data):
+    """
+    Deserialize a value stored by `encode_value()`.
+
+    Args:
+        data (bytes): The encoded value
+
+    Returns:
+        object: The value, with sequences returned as tuples
+    """
+    return _restore_tuples(json.loads(data, object_hook=_decode_bytes))
+
+def make_key(namespace, *parts):
+    """
+    Build a cache key from a namespace and the inputs that determine a value.
+
+    Args:
+        namespace (str): The kind of value, e.g. "image" or "search"
+        *parts: Values identifying the entry; they are hashed together
+
+    Returns:
+        str: A key of the form "namespace:sha256"
+    """
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+    return f"{namespace}:{digest}"
+
+class SQLiteBackend:
+    """
+    Shared state stored in a SQLite file.
+
+    A new connection is opened for each operation, so one backend can be used
+    from every Streamlit session thread, and several processes on the same
+    host can use the same file. SQLite locking is not reliable over network
+    filesystems, so replicas on different hosts should use RedisBackend.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the database file, created if missing
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            # WAL needs shared memory between processes; keep the rollback journal
+            conn.execute("PRAGMA journal_mode=DELETE")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries "
+                    "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS locks "
+                    "(key TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        """
+        Get a value.
+
+        Args:
+            key (str): The key to look up
+
+        Returns:
+            bytes or None: The stored value, or None if missing or expired
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM entries WHERE key = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value.
+
+        Args:
+            key (str): The key to store under
+            value (bytes): The value to store
+            ttl (float, optional): Seconds until the value expires. Never
+                expires if not given
+        """
+        expires_at = time.time() + ttl if ttl else None
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                # Drop expired rows so the file does not grow without bound
+                conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        """
+        Remove a value.
+
+        Args:
+            key (str): The key to remove
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def acquire_lock(self, key, token, timeout):
+        """
+        Take a lock unless another holder has it and it has not expired.
+
+        Args:
+            key (str): The key to lock
+            token (str): A value identifying this holder
+            timeout (float): Seconds until the lock expires
+
+        Returns:
+            bool: True if the lock was taken
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM locks WHERE key = ? AND expires_at <= ?", (key, now))
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO locks (key, token, expires_at) VALUES (?, ?, ?)",
+                    (key, token, now + timeout)
+                )
+                return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def is_locked(self, key):
+        """
+        Check whether a key is locked.
+
+        Args:
+            key (str): The key to check
+
+        Returns:
+            bool: True if an unexpired lock is held on the key
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT 1 FROM locks WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def release_lock(self, key, token):
+        """
+        Release a lock if it is still held by the given token.
+
+        Args:
+            key (str): The locked key
+            token (str): The token passed to acquire_lock
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+        finally:
+            conn.close()
+
+class RedisBackend:
+    """
+    Shared state stored in a server speaking the Redis protocol.
+
+    Any client with the same interface as `redis.Redis` can be passed in,
+    which allows testing against a local stand-in such as fakeredis.
+    """
+
+    def __init__(self, client, prefix="chatbot:"):
+        """
+        Args:
+            client (redis.Redis): The client to use
+            prefix (str, optional): Prepended to all keys. Defaults to "chatbot:"
+        """
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        """
+        Create a backend from a redis:// URL.
+
+        Args:
+            url (str): The server URL
+
+        Returns:
+            RedisBackend: The backend
+
+        Raises:
+            ImportError: If the `redis` package is not installed
+        """
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("The redis package is required for a redis:// SHARED_STATE_URL") from e
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        """
+        Get a value.
+
+        Args:
+            key (str): The key to look up
+
+        Returns:
+            bytes or None: The stored value, or None if missing or expired
+        """
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value.
+
+        Args:
+            key (str): The key to store under
+            value (bytes): The value to store
+            ttl (float, optional): Seconds until the value expires. Never
+                expires if not given
+        """
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key):
+        """
+        Remove a value.
+
+        Args:
+            key (str): The key to remove
+        """
+        self.client.delete(self.prefix + key)
+
+    def acquire_lock(self, key, token, timeout):
+        """
+        Take a lock unless another holder has it and it has not expired.
+
+        Args:
+            key (str): The key to lock
+            token (str): A value identifying this holder
+            timeout (float): Seconds until the lock expires
+
+        Returns:
+            bool: True if the lock was taken
+        """
+        return bool(self.client.set(self.prefix + "lock:" + key, token, nx=True, px=int(timeout * 1000)))
+
+    def is_locked(self, key):
+        """
+        Check whether a key is locked.
+
+        Args:
+            key (str): The key to check
+
+        Returns:
+            bool: True if an unexpired lock is held on the key
+        """
+        return bool(self.client.exists(self.prefix + "lock:" + key))
+
+    def release_lock(self, key, token):
+        """
+        Release a lock if it is still held by the given token.
+
+        Args:
+            key (str): The locked key
+            token (str): The token passed to acquire_lock
+        """
+        import redis
+
+        lock_key = self.prefix + "lock:" + key
+        with self.client.pipeline() as pipe:
+            try:
+                # Only delete the lock if it was not taken over after expiring
+                pipe.watch(lock_key)
+                current = pipe.get(lock_key)
+                if current is not None and current.decode("utf-8") == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+
+def create_backend(url=None):
+    """
+    Create a backend from a URL.
+
+    Args:
+        url (str, optional): "sqlite:///path" or "redis://...". Defaults to the
+            SHARED_STATE_URL environment variable, or a SQLite file in the
+            system temp directory
+
+    Returns:
+        SQLiteBackend or RedisBackend: The backend
+
+    Raises:
+        ValueError: If the URL scheme is not supported
+    """
+    url = url or os.getenv("SHARED_STATE_URL")
+    if not url:
+        return SQLiteBackend(os.path.join(tempfile.gettempdir(), "chatbot_shared_state.db"))
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
+
+def get(key):
+    """
+    Get a value from the shared state.
+
+    Args:
+        key (str): The key to look up
+
+    Returns:
+        object or None: The stored value, or None if missing or expired
+    """
+    data = providers.get("shared_state").get(key)
+    return decode_value(data) if data is not None else None
+
+def put(key, value, ttl=None):
+    """
+    Store a value in the shared state.
+
+    Args:
+        key (str): The key to store under
+        value (object): Any value supported by `encode_value()`
+        ttl (float, optional): Seconds until the value expires
+    """
+    providers.get("shared_state").set(key, encode_value(value), ttl)
+
+def delete(key):
+    """
+    Remove a value from the shared state.
+
+    Args:
+        key (str): The key to remove
+    """
+    providers.get("shared_state").delete(key)
+
+_MISSING = object()
+
+def _load(backend, key):
+    data = backend.get(key)
+    if data is None:
+        return _MISSING
+    try:
+        return decode_value(data)
+    except ValueError:
+        # Written in an older format; treat as a miss so it gets replaced
+        return _MISSING
+
+def _store(backend, key, value, ttl):
+    try:
+        backend.set(key, encode_value(value), ttl)
+    except Exception as e:
+        print(f"Error writing shared state: {str(e)}")
+
+def get_or_create(key, create, ttl=None, cacheable=None, failure_ttl=FAILURE_TTL,
+                  lock_timeout=LOCK_TIMEOUT):
+    """
+    Get a value from the shared state, creating it on a miss.
+
+    Args:
+        key (str): The key to look up
+        create (callable): A function taking no arguments that returns the value
+        ttl (float, optional): Seconds until the created value expires
+        cacheable (callable, optional): Called with the created value; if it
+            returns False the value is only kept for failure_ttl seconds, e.g.
+            for failed API responses
+        failure_ttl (float, optional): Seconds an uncacheable value is kept.
+            Defaults to FAILURE_TTL
+        lock_timeout (float, optional): Seconds the creation lock is held
+            before it is considered abandoned. Defaults to LOCK_TIMEOUT
+
+    Returns:
+        object: The cached or newly created value
+
+    Note:
+        Creation is single-flight: when the key is being created by another
+        replica or session, this waits for that result instead of running
+        `create` again. Waiters also receive an uncacheable result, so a
+        failing API is called once rather than once per waiter. If the other
+        creator raises or its lock expires, this one takes over. Errors from
+        the backend are printed and fall back to calling `create` directly,
+        so the cache never blocks a request.
+    """
+    try:
+        backend = providers.get("shared_state")
+        token = uuid.uuid4().hex
+        while True:
+            value = _load(backend, key)
+            if value is not _MISSING:
+                return value
+            if backend.acquire_lock(key, token, lock_timeout):
+                break
+            # Another creator is running; wait until it stores a value or gives up
+            while backend.is_locked(key) and _load(backend, key) is _MISSING:
+                time.sleep(POLL_INTERVAL)
+    except Exception as e:
+        print(f"Error reading shared state: {str(e)}")
+        return create()
+
+    try:
+        value = create()
+        if cacheable is None or cacheable(value):
+            _store(backend, key, value, ttl)
+        elif failure_ttl:
+            # Keep the failure briefly, so waiters return it instead of retrying
+            _store(backend, key, value, failure_ttl)
+        return value
+    finally:
+        try:
+            backend.release_lock(key, token)
+        except Exception as e:
+            print(f"Error releasing shared state lock: {str(e)}")
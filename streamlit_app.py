@@ -18,20 +18,19 @@ Dependencies:
     - streamlit: For the web interface
     - python-dotenv: For loading environment variables
     - Various custom modules (tts, search, llm, huggingface) for specific functionalities
+    - turns: For running each chat turn in the background, so it survives reruns and disconnects
 """
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from tts import text_to_speech_mixed
-from search import search_brave
-from llm import get_chat_completion, get_research_completion
-from supabase_client import get_total_tokens, track_token_usage
+from supabase_client import get_cached_total_tokens, TOTALS_MAX_AGE
+from turns import start_turn, get_turn
 
 import streamlit as st
 import io
 import os
-from huggingface import generate_image, generate_music
+import secrets
 
 # Show title and description.
 st.title("💬 Chatbot")
@@ -47,15 +46,19 @@ def calculate_cost(prompt_tokens, completion_tokens):
     completion_cost = (completion_tokens / 1000000) * 10
     return prompt_cost + completion_cost
 
-# Add usage stats in the sidebar
-with st.sidebar:
-    st.header("💰 Usage Stats")
-    
+# Render usage stats from the cache, re-reading it as often as it is refreshed
+@st.fragment(run_every=TOTALS_MAX_AGE)
+def usage_stats():
     # Get total usage
-    prompt_tokens, completion_tokens = get_total_tokens()
+    totals = get_cached_total_tokens()
+    if totals is None:
+        st.caption("Loading usage stats...")
+        return
+
+    prompt_tokens, completion_tokens = totals
     total_tokens = prompt_tokens + completion_tokens
     total_cost = calculate_cost(prompt_tokens, completion_tokens)
-    
+
     # Display stats
     col1, col2 = st.columns(2)
     with col1:
@@ -65,6 +68,11 @@ with st.sidebar:
         st.metric("Total Tokens", f"{total_tokens:,}")
         st.metric("Completion Tokens", f"{completion_tokens:,}")
 
+# Add usage stats in the sidebar
+with st.sidebar:
+    st.header("💰 Usage Stats")
+    usage_stats()
+
 # Get API key from environment variable
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
@@ -83,6 +91,16 @@ else:
         st.session_state.input_disabled = False
     if "is_processing" not in st.session_state:
         st.session_state.is_processing = False
+    # Identify the conversation with an unguessable token kept in the URL, so a
+    # reloaded or reopened tab can pick up its last turn
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = st.query_params.get("session") or secrets.token_urlsafe(16)
+    st.query_params["session"] = st.session_state.session_id
+    # The turn this tab is following, if any
+    if "turn_id" not in st.session_state:
+        st.session_state.turn_id = None
+    if "turn_errors" not in st.session_state:
+        st.session_state.turn_errors = []
 
     def disable_input():
         st.session_state.is_processing = True
@@ -92,6 +110,23 @@ else:
         st.session_state.is_processing = False
         st.session_state.input_disabled = False
 
+    # Reattach to a turn started before a rerun, disconnect or reload
+    job = get_turn(st.session_state.session_id)
+    if job is not None and not st.session_state.messages and not st.session_state.turn_id:
+        # A reloaded or reopened tab: restore the conversation the turn started from
+        st.session_state.messages = list(job.messages)
+        st.session_state.media = list(job.media)
+        st.session_state.turn_id = job.turn_id
+    if job is None or job.turn_id != st.session_state.turn_id:
+        # No turn, or one this tab has already stored
+        job = None
+
+    if job is not None:
+        disable_input()
+    else:
+        st.session_state.turn_id = None
+        enable_input()
+
     # Display the existing chat messages and media via `st.chat_message`
     for i, message in enumerate(st.session_state.messages):
         with st.chat_message(message["role"]):
@@ -107,176 +142,56 @@ else:
                 elif media["type"] == "text":
                     st.markdown(media["data"])
 
+    # Show errors from the last turn, such as a tool failure or a timeout, until the next prompt
+    for error in st.session_state.turn_errors:
+        st.error(error)
+
     # Create a chat input field to allow the user to enter a message
     if prompt := st.chat_input("How may I assist you?", disabled=st.session_state.is_processing):
         st.session_state.messages.append({"role": "user", "content": prompt})
         st.session_state.media.append(None)  # No media for user messages
-        disable_input()
+        st.session_state.turn_errors = []
+        # The turn runs in the background, so a rerun or disconnect does not lose it
+        try:
+            job = start_turn(st.session_state.session_id, st.session_state.messages, st.session_state.media)
+        except RuntimeError:
+            # Another tab of this conversation is still waiting for a response
+            st.session_state.messages.pop()
+            st.session_state.media.pop()
+            st.session_state.turn_errors = ["This conversation is busy in another tab. Please try again once it has responded."]
+        else:
+            st.session_state.turn_id = job.turn_id
+            disable_input()
         st.rerun()
 
-    if st.session_state.is_processing and len(st.session_state.messages) > 0:
-        # Get the last user message
-        prompt = st.session_state.messages[-1]["content"]
-        
-        # Stream the response to the chat and handle function calls
-        full_response = ""
-        accumulated_tool_calls = []
-        current_tool_call = None
-        current_tool_args = ""
-        receiving_tool_calls = False
-        
+    if job is not None:
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
             spinner_placeholder = st.empty()
-            spinner = None
-            
-            stream = get_chat_completion(st.session_state.messages)
-            
-            for chunk in stream:
-                # Handle usage data in the last chunk
-                if hasattr(chunk, 'usage') and chunk.usage:
-                    # Track token usage
-                    track_token_usage(
-                        chunk.usage.prompt_tokens,
-                        chunk.usage.completion_tokens
-                    )
-
-                # Skip empty chunks
-                if not hasattr(chunk, 'choices') or not chunk.choices:
-                    continue
-                    
-                delta = chunk.choices[0].delta
-                
-                # Handle tool calls
-                if hasattr(delta, 'tool_calls') and delta.tool_calls:
-                    if not receiving_tool_calls:
-                        receiving_tool_calls = True
-                        # Show spinner when first detecting tool calls
-                        spinner = st.spinner("Generating media, this may take a while...")
-                        spinner.__enter__()
-                    
-                    tool_call = delta.tool_calls[0]
-                    
-                    # Start of new tool call
-                    if tool_call.index is not None and current_tool_call is None:
-                        current_tool_call = {
-                            "name": tool_call.function.name,
-                            "arguments": ""
-                        }
-                    
-                    # Accumulate tool call arguments
-                    if tool_call.function and tool_call.function.arguments:
-                        current_tool_args += tool_call.function.arguments
-                        
-                    # If we have a complete tool call, add it to accumulated calls
-                    if current_tool_call and current_tool_args:
-                        try:
-                            import json
-                            args = json.loads(current_tool_args)
-                            accumulated_tool_calls.append({
-                                "name": current_tool_call["name"],
-                                "arguments": args
-                            })
-                            current_tool_call = None
-                            current_tool_args = ""
-                        except json.JSONDecodeError:
-                            # Continue accumulating if JSON is incomplete
-                            pass
-                
-                # Handle regular content
-                if delta.content:
-                    full_response += delta.content
-                    message_placeholder.markdown(full_response + "▌")
-            
-            # After streaming loop, execute accumulated tool calls
-            if accumulated_tool_calls:
-                for tool_call in accumulated_tool_calls:
-                    try:
-                        print(f"Debug: Executing tool call: {tool_call['name']}")
-                        
-                        if tool_call["name"] == "generate_image":
-                            print(f"Debug: Generating image with prompt: {tool_call['arguments']['prompt']}")
-                            result_bytes = generate_image(tool_call["arguments"]["prompt"])
-                            
-                            # Store media first
-                            st.session_state.media.append({"type": "image", "data": result_bytes})
-                            # Add a placeholder message for the assistant
-                            st.session_state.messages.append({"role": "assistant", "content": "Here is the image you requested:"})
-                            
-                            enable_input()
-
-                        elif tool_call["name"] == "generate_music":
-                            print(f"Debug: Generating music with arguments: {tool_call['arguments']}")
-                            result_bytes = generate_music(tool_call["arguments"]["prompt"])
-                            if tool_call["arguments"]["has_lyrics"]:
-                                lyrics = tool_call["arguments"]["lyrics"]
-                                prev_result_bytes = result_bytes
-                                try:
-                                    result_bytes = text_to_speech_mixed(lyrics, result_bytes)
-                                except Exception as e:
-                                    st.error(f"Error generating music with lyrics: {str(e)}")
-                                    result_bytes = prev_result_bytes
-                            
-                            # Store media first
-                            st.session_state.media.append({"type": "audio", "data": result_bytes})
-                            # Add a placeholder message for the assistant
-                            st.session_state.messages.append({"role": "assistant", "content": "Here is the music you requested:"})
-                            
-                            enable_input()
 
-                        elif tool_call["name"] == "generate_research":
-                            print(f"Debug: Generating research paper")
-                            # Get search results first
-                            search_results = search_brave(tool_call["arguments"]["query"])
-                            
-                            # Exit spinner since we're about to start streaming the paper
-                            if spinner:
-                                spinner.__exit__(None, None, None)
-                            
-                            # Stream the research paper generation
-                            research_stream = get_research_completion(tool_call["arguments"]["query"], search_results)
-                            
-                            paper_content = ""
-                            for chunk in research_stream:                                    
-                                # Handle usage data in the last chunk
-                                if hasattr(chunk, 'usage') and chunk.usage:
-                                    # Track token usage
-                                    track_token_usage(
-                                        chunk.usage.prompt_tokens,
-                                        chunk.usage.completion_tokens
-                                    )
-
-                                # Skip empty chunks
-                                if not hasattr(chunk, 'choices') or not chunk.choices:
-                                    continue
-                                    
-                                if chunk.choices[0].delta.content:
-                                    paper_content += chunk.choices[0].delta.content
-                                    message_placeholder.markdown(paper_content + "▌")
-                            
-                            # Store the final paper as a regular assistant message
-                            message_placeholder.markdown(paper_content)
-                            st.session_state.messages.append({"role": "assistant", "content": paper_content})
-                            st.session_state.media.append(None)  # No media needed since it's in the message
-                            
-                            enable_input()
-
-                    except Exception as e:
-                        st.error(f"Error executing tool call: {str(e)}")
-                
-                # Exit the spinner context if it was created
-                if spinner:
-                    spinner.__exit__(None, None, None)
-                
-                # Rerun after all tool calls are processed
-                st.rerun()
-
-            # Only store text response if there was actual text content
-            if full_response.strip():
-                message_placeholder.markdown(full_response)
-                st.session_state.messages.append({"role": "assistant", "content": full_response})
-                st.session_state.media.append(None)  # No media for text responses
-
-            # Re-enable input after response is complete
-            enable_input()
-            st.rerun()
+            # Render the buffered output, then follow the turn until it is done
+            revision = -1
+            while not job.done:
+                revision = job.wait(revision, timeout=1)
+
+                if job.text:
+                    message_placeholder.markdown(job.text + "▌")
+                else:
+                    message_placeholder.empty()
+
+                if job.generating_media:
+                    with spinner_placeholder, st.spinner("Generating media, this may take a while..."):
+                        while job.generating_media and not job.done:
+                            revision = job.wait(revision, timeout=1)
+                    spinner_placeholder.empty()
+
+            # Store the turn's messages, media and errors
+            st.session_state.turn_errors = list(job.errors)
+            for message, media in job.results:
+                st.session_state.messages.append(message)
+                st.session_state.media.append(media)
+            st.session_state.turn_id = None
+
+        # Re-enable input after response is complete
+        enable_input()
+        st.rerun()
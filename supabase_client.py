@@ -1,29 +1,43 @@
 """
 Supabase client setup and token tracking functionality.
+
+The Supabase client is created on first use through the `providers` registry.
+Total usage is served from an in-process cache that is refreshed in a background
+thread, so rendering the usage stats never waits on a network call. Refreshes go
+through the shared state, so one replica queries Supabase per refresh interval
+and the others reuse its result.
 """
 
-from supabase import create_client
-import os
+import providers
+import shared_state
+import threading
+import time
 from datetime import datetime
 
-# Initialize Supabase client
-supabase = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
-)
+# Seconds before cached totals are refreshed in the background
+TOTALS_MAX_AGE = 60
+
+# Shared state key holding the totals last fetched by any replica
+TOTALS_KEY = "usage:totals"
+
+_totals = None
+_totals_fetched_at = 0.0
+_totals_refreshing = False
+_totals_lock = threading.Lock()
 
 def track_token_usage(prompt_tokens, completion_tokens, model="gpt-4o"):
     """
     Track token usage for a chat completion request.
-    
+
     Args:
         prompt_tokens (int): Number of tokens in the prompt
         completion_tokens (int): Number of tokens in the completion
         model (str): The model used for the completion
     """
+    global _totals
     try:
         # Insert usage data
-        supabase.table('token_usage').insert({
+        providers.get("supabase").table('token_usage').insert({
             'timestamp': datetime.utcnow().isoformat(),
             'model': model,
             'prompt_tokens': prompt_tokens,
@@ -32,22 +46,72 @@ def track_token_usage(prompt_tokens, completion_tokens, model="gpt-4o"):
         }).execute()
     except Exception as e:
         print(f"Error tracking token usage: {str(e)}")
+        return
 
-def get_total_tokens():
-    """
-    Get total token usage across all time.
-    
-    Returns:
-        tuple: (prompt_tokens, completion_tokens) across all time
-    """
+    # Drop the shared totals, so the next refresh on any replica sees this usage
+    try:
+        shared_state.delete(TOTALS_KEY)
+    except Exception as e:
+        print(f"Error invalidating shared token totals: {str(e)}")
+
+    # Keep the cached totals current without another round trip
+    with _totals_lock:
+        if _totals is not None:
+            _totals = (_totals[0] + prompt_tokens, _totals[1] + completion_tokens)
+
+def _query_total_tokens():
+    response = providers.get("supabase").table('token_usage')\
+        .select('prompt_tokens,completion_tokens')\
+        .execute()
+
+    prompt_tokens = sum(row['prompt_tokens'] for row in response.data)
+    completion_tokens = sum(row['completion_tokens'] for row in response.data)
+    return prompt_tokens, completion_tokens
+
+def _refresh_totals():
+    global _totals, _totals_fetched_at, _totals_refreshing
     try:
-        response = supabase.table('token_usage')\
-            .select('prompt_tokens,completion_tokens')\
-            .execute()
-        
-        prompt_tokens = sum(row['prompt_tokens'] for row in response.data)
-        completion_tokens = sum(row['completion_tokens'] for row in response.data)
-        return prompt_tokens, completion_tokens
+        totals = shared_state.get_or_create(
+            TOTALS_KEY,
+            _query_total_tokens,
+            ttl=TOTALS_MAX_AGE
+        )
     except Exception as e:
         print(f"Error getting total tokens: {str(e)}")
-        return 0, 0 
\ No newline at end of file
+        # Keep showing the last known totals rather than zeros
+        totals = None
+
+    with _totals_lock:
+        if _totals is None:
+            _totals = totals or (0, 0)
+        elif totals is not None:
+            # Totals only grow; a replica may have cached them before our latest usage
+            _totals = (max(_totals[0], totals[0]), max(_totals[1], totals[1]))
+        _totals_fetched_at = time.monotonic()
+        _totals_refreshing = False
+
+def get_cached_total_tokens(max_age=TOTALS_MAX_AGE):
+    """
+    Get total token usage from the cache without blocking.
+
+    Args:
+        max_age (float, optional): Seconds after which the cached totals are
+            refreshed. Defaults to TOTALS_MAX_AGE
+
+    Returns:
+        tuple or None: (prompt_tokens, completion_tokens) as last fetched, or
+        None if the first fetch has not finished yet
+
+    Note:
+        When the cache is empty or older than max_age, a background thread
+        fetches fresh totals and the current value is returned immediately.
+        Only one refresh runs at a time.
+    """
+    global _totals_refreshing
+    with _totals_lock:
+        totals = _totals
+        stale = totals is None or time.monotonic() - _totals_fetched_at > max_age
+        if stale and not _totals_refreshing:
+            _totals_refreshing = True
+            threading.Thread(target=_refresh_totals, daemon=True).start()
+    return totals
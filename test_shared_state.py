@@ -0,0 +1,109 @@
+"""
+Tests for the shared state backends and single-flight caching.
+
+The Redis backend runs against fakeredis, a local stand-in for a Redis server.
+These tests are skipped if fakeredis is not installed.
+
+Usage:
+    pip install pytest fakeredis
+    python -m pytest
+"""
+
+import threading
+import time
+
+import pytest
+
+import providers
+import shared_state
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        backend = shared_state.SQLiteBackend(str(tmp_path / "shared_state.db"))
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        backend = shared_state.RedisBackend(fakeredis.FakeRedis())
+
+    providers.register("shared_state", lambda: backend)
+    yield backend
+    providers.register("shared_state", shared_state.create_backend)
+
+def test_get_put_delete(backend):
+    assert shared_state.get("key") is None
+
+    shared_state.put("key", (True, b"\x00data"))
+    assert shared_state.get("key") == (True, b"\x00data")
+
+    shared_state.delete("key")
+    assert shared_state.get("key") is None
+
+def test_ttl_expires(backend):
+    shared_state.put("key", "value", ttl=0.2)
+    assert shared_state.get("key") == "value"
+
+    time.sleep(0.3)
+    assert shared_state.get("key") is None
+
+def test_lock_acquire_and_release(backend):
+    assert backend.acquire_lock("key", "first", timeout=10)
+    assert not backend.acquire_lock("key", "second", timeout=10)
+    assert backend.is_locked("key")
+
+    # Only the holder's token releases the lock
+    backend.release_lock("key", "second")
+    assert backend.is_locked("key")
+
+    backend.release_lock("key", "first")
+    assert not backend.is_locked("key")
+    assert backend.acquire_lock("key", "second", timeout=10)
+
+def test_lock_expires(backend):
+    assert backend.acquire_lock("key", "first", timeout=0.2)
+    time.sleep(0.3)
+
+    assert not backend.is_locked("key")
+    assert backend.acquire_lock("key", "second", timeout=10)
+
+def run_concurrently(count, target):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(target())) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+@pytest.mark.parametrize("ok", [True, False])
+def test_get_or_create_is_single_flight(backend, monkeypatch, ok):
+    monkeypatch.setattr(shared_state, "POLL_INTERVAL", 0.05)
+    calls = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.3)
+        return ok, b"result"
+
+    results = run_concurrently(5, lambda: shared_state.get_or_create(
+        "key", create, cacheable=lambda result: result[0]
+    ))
+
+    # Waiters share the result even when it is not cacheable
+    assert results == [(ok, b"result")] * 5
+    assert len(calls) == 1
+    assert not backend.is_locked("key")
+
+def test_get_or_create_retries_after_failure_ttl(backend):
+    calls = []
+
+    def create():
+        calls.append(1)
+        return False, b"error"
+
+    shared_state.get_or_create("key", create, cacheable=lambda result: result[0], failure_ttl=0.2)
+    shared_state.get_or_create("key", create, cacheable=lambda result: result[0], failure_ttl=0.2)
+    assert len(calls) == 1
+
+    time.sleep(0.3)
+    shared_state.get_or_create("key", create, cacheable=lambda result: result[0], failure_ttl=0.2)
+    assert len(calls) == 2
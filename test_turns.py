@@ -0,0 +1,147 @@
+"""
+Tests for background turn execution, using fake OpenAI streams.
+
+Usage:
+    pip install pytest
+    python -m pytest
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import turns
+
+def text_chunk(content):
+    delta = SimpleNamespace(content=content, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+def tool_chunk(name, arguments):
+    function = SimpleNamespace(name=name, arguments=arguments)
+    delta = SimpleNamespace(content=None, tool_calls=[SimpleNamespace(index=0, function=function)])
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+def usage_chunk(prompt_tokens, completion_tokens):
+    usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return SimpleNamespace(choices=[], usage=usage)
+
+class FakeStream:
+    """A stream of chunks that can block before finishing, and records being closed."""
+
+    def __init__(self, chunks, release=None):
+        self.chunks = chunks
+        self.release = release
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.chunks
+        if self.release is not None:
+            self.release.wait()
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture(autouse=True)
+def fake_services(monkeypatch):
+    usage = []
+    monkeypatch.setattr(turns, "_jobs", {})
+    monkeypatch.setattr(turns, "track_token_usage", lambda prompt, completion: usage.append((prompt, completion)))
+    return usage
+
+def finish(job, timeout=5):
+    # Follow the job the way the app does, until it is done
+    revision = -1
+    end = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < end, "turn did not finish"
+        revision = job.wait(revision, timeout=0.05)
+
+def test_text_response(monkeypatch, fake_services):
+    stream = FakeStream([text_chunk("Hello"), text_chunk(" there"), usage_chunk(3, 2)])
+    monkeypatch.setattr(turns, "get_chat_completion", lambda messages: stream)
+
+    job = turns.start_turn("session", [{"role": "user", "content": "hi"}], [None])
+    finish(job)
+
+    assert job.text == "Hello there"
+    assert job.results == [({"role": "assistant", "content": "Hello there"}, None)]
+    assert job.errors == []
+    # One revision per text chunk, plus one for finishing
+    assert job.revision == 3
+    assert fake_services == [(3, 2)]
+    assert turns.get_turn("session") is job
+
+def test_failing_tool_call(monkeypatch):
+    stream = FakeStream([tool_chunk("generate_image", '{"prompt": "a cat"}')])
+    monkeypatch.setattr(turns, "get_chat_completion", lambda messages: stream)
+
+    def generate_image(prompt):
+        raise ValueError("model is loading")
+
+    monkeypatch.setattr(turns, "generate_image", generate_image)
+
+    job = turns.start_turn("session", [{"role": "user", "content": "draw a cat"}], [None])
+    finish(job)
+
+    assert job.results == []
+    assert job.errors == ["Error executing tool call: model is loading"]
+    assert not job.generating_media
+
+def test_deadline_cancels_and_closes_stream(monkeypatch):
+    release = threading.Event()
+    stream = FakeStream([text_chunk("partial")], release=release)
+    monkeypatch.setattr(turns, "get_chat_completion", lambda messages: stream)
+
+    job = turns.TurnJob("session", "turn", [], [], timeout=0.2)
+    job.start()
+    finish(job)
+
+    assert job.results == []
+    assert len(job.errors) == 1
+    assert "took too long" in job.errors[0]
+
+    # Once the hung stream returns, the thread stops and closes it
+    release.set()
+    job._thread.join(timeout=5)
+    assert not job._thread.is_alive()
+    assert stream.closed
+    assert job.results == []
+
+def test_one_running_turn_per_session(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(turns, "get_chat_completion", lambda messages: FakeStream([text_chunk("hi")], release=release))
+
+    first = turns.start_turn("session", [{"role": "user", "content": "hi"}], [None])
+    with pytest.raises(RuntimeError):
+        turns.start_turn("session", [{"role": "user", "content": "hello"}], [None])
+
+    # Other sessions are not affected
+    other = turns.start_turn("other", [{"role": "user", "content": "hi"}], [None])
+
+    release.set()
+    finish(first)
+    finish(other)
+
+    second = turns.start_turn("session", [{"role": "user", "content": "hello"}], [None])
+    assert second.turn_id != first.turn_id
+    assert turns.get_turn("session") is second
+    finish(second)
+
+def test_cancelled_turn_is_kept_for_its_session(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(turns, "JOB_DEADLINE", 0.2)
+    monkeypatch.setattr(turns, "get_chat_completion", lambda messages: FakeStream([], release=release))
+
+    stuck = turns.start_turn("stuck", [{"role": "user", "content": "hi"}], [None])
+    time.sleep(0.3)
+
+    # Another session's start prunes the registry and cancels the stuck turn
+    turns.start_turn("other", [{"role": "user", "content": "hi"}], [None])
+
+    job = turns.get_turn("stuck")
+    assert job is stuck
+    assert job.done
+    assert "took too long" in job.errors[0]
+    release.set()
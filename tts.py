@@ -11,11 +11,12 @@ Required Environment Variables:
 Dependencies:
     - elevenlabs: For text-to-speech conversion
     - pydub: For audio processing and mixing
+
+Both packages are imported on first use, since loading pydub and the ElevenLabs
+SDK is only needed once the user asks for a song with lyrics.
 """
 
-import os
-import elevenlabs
-from pydub import AudioSegment
+import providers
 from io import BytesIO
 
 def mix_audio(music_bytes, audio_bytes):
@@ -34,6 +35,8 @@ def mix_audio(music_bytes, audio_bytes):
         - Adds 1 second of silence at the beginning of the overlay
         - Trims the overlay to match the length of the background music
     """
+    from pydub import AudioSegment
+
     # Create file-like objects from bytes
     music_io = BytesIO(music_bytes)
     audio_io = BytesIO(audio_bytes)
@@ -68,7 +71,7 @@ def text_to_speech_mixed(text, music_bytes):
     Note:
         Uses the 'Adam' voice from ElevenLabs for speech generation
     """
-    client = elevenlabs.ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+    client = providers.get("elevenlabs")
     
     bytes = b""
     for chunk in client.generate(text=text, voice="Adam"):
@@ -0,0 +1,385 @@
+"""
+Background Turn Execution Module
+
+This module runs each chat turn (the chat completion stream, and any image,
+music or research tool calls it triggers) in a background thread instead of the
+Streamlit script thread. A rerun, a dropped connection or a closed tab stops the
+script, but not the turn: the job keeps buffering its output, and the next
+script run for the same session reattaches to it and continues rendering from
+the buffer.
+
+Sessions are identified by a random token that the app keeps in the URL, so a
+reloaded or reopened tab finds its session's last turn and restores the
+conversation from it. A turn whose tab is never reopened still runs to
+completion, and its result is dropped JOB_TTL seconds after it finishes.
+
+Jobs are kept in a process-local registry holding the latest turn of each
+session, and a session can only run one turn at a time. Turns still running
+after JOB_DEADLINE seconds are cancelled with an error.
+"""
+
+import json
+import threading
+import time
+import uuid
+
+from tts import text_to_speech_mixed
+from search import search_brave
+from llm import get_chat_completion, get_research_completion
+from supabase_client import track_token_usage
+from huggingface import generate_image, generate_music
+
+# Seconds a finished job is kept for its session to pick up
+JOB_TTL = 60 * 60
+
+# Seconds a turn may run before it is cancelled and reported as timed out
+JOB_DEADLINE = 10 * 60
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class TurnCancelled(Exception):
+    """Raised in a job's thread to stop it once the job has been cancelled."""
+
+class TurnJob:
+    """
+    A single chat turn running in a background thread.
+
+    The streamed text is buffered in `text`, and every change to the job bumps
+    `revision`. Readers keep the last revision they rendered and call `wait()`
+    to block until there is something new.
+
+    A job that runs past its deadline is cancelled: it is marked done with an
+    error, and its thread stops at the next chunk or update and discards its
+    results. Blocking API calls are bounded by the providers' timeouts.
+
+    Attributes:
+        session_id (str): The token of the session that started the turn
+        turn_id (str): A random id identifying the turn
+        messages (list): The message history the turn was started with
+        media (list): The media history the turn was started with
+        text (str): The text streamed so far
+        generating_media (bool): True while tool calls are running
+        results (list): (message, media) pairs to append once the turn is done
+        errors (list): Error messages raised by tool calls
+        done (bool): True once the turn has finished or was cancelled
+        deadline (float): `time.monotonic()` value after which the turn is cancelled
+    """
+
+    def __init__(self, session_id, turn_id, messages, media, timeout=None):
+        """
+        Args:
+            session_id (str): The token of the session starting the turn
+            turn_id (str): A random id identifying the turn
+            messages (list): The message history, ending with the user's message
+            media (list): The media history, aligned with messages
+            timeout (float, optional): Seconds the turn may run before it is
+                cancelled. Defaults to JOB_DEADLINE
+        """
+        self.session_id = session_id
+        self.turn_id = turn_id
+        self.messages = list(messages)
+        self.media = list(media)
+        self.text = ""
+        self.generating_media = False
+        self.results = []
+        self.errors = []
+        self.done = False
+        self.deadline = time.monotonic() + (timeout or JOB_DEADLINE)
+        self.revision = 0
+        self.finished_at = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def wait(self, revision, timeout=None):
+        """
+        Wait until the job changes after the given revision.
+
+        Args:
+            revision (int): The last revision the caller has seen
+            timeout (float, optional): Seconds to wait at most
+
+        Returns:
+            int: The current revision, unchanged if the wait timed out
+
+        Note:
+            Cancels the job if it is past its deadline, so a reader polling
+            with a timeout always sees a hung turn end.
+        """
+        self.check_deadline()
+        with self._condition:
+            self._condition.wait_for(lambda: self.revision > revision or self.done, timeout)
+            return self.revision
+
+    def check_deadline(self):
+        """
+        Cancel the job if it is still running past its deadline.
+
+        Returns:
+            bool: True if the job was cancelled by this call
+        """
+        if self.done or time.monotonic() < self.deadline:
+            return False
+        return self.cancel("The response took too long and was cancelled. Please try again.")
+
+    def cancel(self, reason):
+        """
+        Mark the job done with an error and stop its thread.
+
+        Args:
+            reason (str): The error message shown to the user
+
+        Returns:
+            bool: True if the job was cancelled, False if it had already finished
+        """
+        with self._condition:
+            if self.done:
+                return False
+            self.results = []
+            self.errors.append(reason)
+            self._finish()
+            return True
+
+    def _finish(self):
+        # Must be called with the condition held
+        self.done = True
+        self.generating_media = False
+        self.finished_at = time.monotonic()
+        self.revision += 1
+        self._condition.notify_all()
+
+    def _update(self, **fields):
+        with self._condition:
+            if self.done:
+                raise TurnCancelled()
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.revision += 1
+            self._condition.notify_all()
+
+    def _append_text(self, content):
+        with self._condition:
+            if self.done:
+                raise TurnCancelled()
+            self.text += content
+            self.revision += 1
+            self._condition.notify_all()
+
+    def _add_result(self, message, media):
+        with self._condition:
+            if self.done:
+                raise TurnCancelled()
+            self.results.append((message, media))
+
+    def _add_error(self, error):
+        with self._condition:
+            if not self.done:
+                self.errors.append(error)
+
+    def _follow(self, stream):
+        # Yield the stream's chunks until it ends or the job is cancelled
+        try:
+            for chunk in stream:
+                self._consume_usage(chunk)
+                if self.done:
+                    raise TurnCancelled()
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+
+    def _run(self):
+        try:
+            self._run_turn()
+        except TurnCancelled:
+            pass
+        except Exception as e:
+            print(f"Error running turn: {str(e)}")
+            self._add_error(f"Error generating response: {str(e)}")
+        finally:
+            with self._condition:
+                if not self.done:
+                    self._finish()
+
+    def _consume_usage(self, chunk):
+        # Handle usage data in the last chunk
+        if hasattr(chunk, 'usage') and chunk.usage:
+            # Track token usage
+            track_token_usage(
+                chunk.usage.prompt_tokens,
+                chunk.usage.completion_tokens
+            )
+
+    def _run_turn(self):
+        # Stream the response and accumulate function calls
+        accumulated_tool_calls = []
+        current_tool_call = None
+        current_tool_args = ""
+
+        stream = get_chat_completion(self.messages)
+
+        for chunk in self._follow(stream):
+            # Skip empty chunks
+            if not hasattr(chunk, 'choices') or not chunk.choices:
+                continue
+
+            delta = chunk.choices[0].delta
+
+            # Handle tool calls
+            if hasattr(delta, 'tool_calls') and delta.tool_calls:
+                if not self.generating_media:
+                    self._update(generating_media=True)
+
+                tool_call = delta.tool_calls[0]
+
+                # Start of new tool call
+                if tool_call.index is not None and current_tool_call is None:
+                    current_tool_call = {
+                        "name": tool_call.function.name,
+                        "arguments": ""
+                    }
+
+                # Accumulate tool call arguments
+                if tool_call.function and tool_call.function.arguments:
+                    current_tool_args += tool_call.function.arguments
+
+                # If we have a complete tool call, add it to accumulated calls
+                if current_tool_call and current_tool_args:
+                    try:
+                        args = json.loads(current_tool_args)
+                        accumulated_tool_calls.append({
+                            "name": current_tool_call["name"],
+                            "arguments": args
+                        })
+                        current_tool_call = None
+                        current_tool_args = ""
+                    except json.JSONDecodeError:
+                        # Continue accumulating if JSON is incomplete
+                        pass
+
+            # Handle regular content
+            if delta.content:
+                self._append_text(delta.content)
+
+        # Execute accumulated tool calls; their text replaces the streamed text
+        if accumulated_tool_calls:
+            for tool_call in accumulated_tool_calls:
+                try:
+                    self._run_tool_call(tool_call)
+                except TurnCancelled:
+                    raise
+                except Exception as e:
+                    self._add_error(f"Error executing tool call: {str(e)}")
+            return
+
+        # Only store text response if there was actual text content
+        if self.text.strip():
+            self._add_result({"role": "assistant", "content": self.text}, None)
+
+    def _run_tool_call(self, tool_call):
+        print(f"Debug: Executing tool call: {tool_call['name']}")
+        # Show the spinner for each tool call; research turns it off to stream its paper
+        self._update(generating_media=True)
+
+        if tool_call["name"] == "generate_image":
+            print(f"Debug: Generating image with prompt: {tool_call['arguments']['prompt']}")
+            result_bytes = generate_image(tool_call["arguments"]["prompt"])
+            self._add_result(
+                {"role": "assistant", "content": "Here is the image you requested:"},
+                {"type": "image", "data": result_bytes}
+            )
+
+        elif tool_call["name"] == "generate_music":
+            print(f"Debug: Generating music with arguments: {tool_call['arguments']}")
+            result_bytes = generate_music(tool_call["arguments"]["prompt"])
+            if tool_call["arguments"]["has_lyrics"]:
+                lyrics = tool_call["arguments"]["lyrics"]
+                try:
+                    result_bytes = text_to_speech_mixed(lyrics, result_bytes)
+                except Exception as e:
+                    self._add_error(f"Error generating music with lyrics: {str(e)}")
+            self._add_result(
+                {"role": "assistant", "content": "Here is the music you requested:"},
+                {"type": "audio", "data": result_bytes}
+            )
+
+        elif tool_call["name"] == "generate_research":
+            print(f"Debug: Generating research paper")
+            # Get search results first
+            search_results = search_brave(tool_call["arguments"]["query"])
+
+            # Stop the media spinner and stream the paper in place of the text
+            self._update(generating_media=False, text="")
+            research_stream = get_research_completion(tool_call["arguments"]["query"], search_results)
+
+            for chunk in self._follow(research_stream):
+                # Skip empty chunks
+                if not hasattr(chunk, 'choices') or not chunk.choices:
+                    continue
+
+                if chunk.choices[0].delta.content:
+                    self._append_text(chunk.choices[0].delta.content)
+
+            # Store the final paper as a regular assistant message
+            self._add_result({"role": "assistant", "content": self.text}, None)
+
+def start_turn(session_id, messages, media):
+    """
+    Start a turn in the background, replacing the session's previous turn.
+
+    Args:
+        session_id (str): The session token starting the turn
+        messages (list): The message history, ending with the user's message
+        media (list): The media history, aligned with messages
+
+    Returns:
+        TurnJob: The new job
+
+    Raises:
+        RuntimeError: If the session's previous turn is still running
+    """
+    with _jobs_lock:
+        _prune_jobs()
+        job = _jobs.get(session_id)
+        if job is not None and not job.done:
+            raise RuntimeError(f"Session already has a running turn: {job.turn_id}")
+
+        job = TurnJob(session_id, uuid.uuid4().hex, messages, media)
+        _jobs[session_id] = job
+        job.start()
+        return job
+
+def get_turn(session_id):
+    """
+    Get the session's latest turn, running or finished.
+
+    Args:
+        session_id (str): The session token
+
+    Returns:
+        TurnJob or None: The job, or None if the session has no turn or its
+        last turn finished more than JOB_TTL seconds ago
+
+    Note:
+        A job past its deadline is returned cancelled, so its session can
+        show the error.
+    """
+    with _jobs_lock:
+        job = _jobs.get(session_id)
+        if job is not None:
+            job.check_deadline()
+        _prune_jobs()
+        return job
+
+def _prune_jobs():
+    now = time.monotonic()
+    for session_id, job in list(_jobs.items()):
+        # Cancel turns stuck past their deadline; they are kept like other
+        # finished jobs, so their session can still show the error
+        job.check_deadline()
+        if job.done and now - job.finished_at > JOB_TTL:
+            del _jobs[session_id]